@@ -32,6 +32,7 @@ setup(
         "python-dateutil>=2.8.1",
         "PyYAML>=5.3",
         "requests>=2.22.0",
+        "requests-toolbelt>=0.9.1",
     ],
     classifiers=[
         "License :: OSI Approved :: Apache Software License",
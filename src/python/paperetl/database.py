@@ -16,6 +16,17 @@ class Database:
             article: article metadata and text content
         """
 
+    def savemany(self, articles):
+        """
+        Saves a batch of articles.
+
+        Args:
+            articles: list of articles
+        """
+
+        for article in articles:
+            self.save(article)
+
     def complete(self):
         """
         Signals processing is complete and runs final storage methods.
@@ -5,13 +5,15 @@ Defines main entry point for ETL process.
 import sys
 import logging
 import time
-import os
-logging.basicConfig(filename="/home/savchuki/projects/dzne-llm/text-extraction/paperetl/logs/log.txt", level=logging.INFO)
-logging.info(f"Started {time.strftime('%Y-%m-%d %H:%M:%S')}")
+
 from .execute import Execute
 
 #indir, url, config=None, replace=False
 if __name__ == "__main__":
+    # Log to console, a logfile set in the config is added by Execute.run
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"Started {time.strftime('%Y-%m-%d %H:%M:%S')}")
+
     # print(sys.argv[0], sys.argv[1], sys.argv[2])
     if len(sys.argv) == 2:
         # Running from config
@@ -3,12 +3,19 @@ Transforms and loads medical/scientific files into an articles database.
 """
 
 import gzip
+import io
 import os
 
-from multiprocessing import Process, Queue
-import psutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import BoundedSemaphore, Pool, Queue as ProcessQueue, Value
+from queue import Empty, Queue
+from threading import Event, Semaphore, Thread
 import json
 
+import requests
+
 from ..factory import Factory
 
 from .arx import ARX
@@ -26,8 +33,29 @@ class Execute:
     Transforms and loads medical/scientific files into an articles database.
     """
 
-    # Completion process signal
-    COMPLETE = 1
+    # Default number of concurrent GROBID requests, matches the GROBID service default
+    CONCURRENCY = 10
+
+    # Supported file formats
+    EXTENSIONS = frozenset(["csv", "pdf", "xml"])
+
+    # Configuration dictionary, set once per worker process
+    CONFIG = None
+
+    # Minimum number of PDFs sent to a worker process per task
+    CHUNKSIZE = 4
+
+    # Maximum number of articles saved per database call and sent per worker message
+    BATCH = 100
+
+    # Maximum number of article chunks buffered between worker processes and the main process
+    QUEUESIZE = 300
+
+    # Outputs queue used to send article chunks to the main process, set once per worker process
+    OUTPUTS = None
+
+    # Read buffer size for compressed files
+    READ_BUFFER_SIZE = 128 * 1024
 
     @staticmethod
     def mode(source, extension):
@@ -48,6 +76,29 @@ class Execute:
             else "r"
         )
 
+    @staticmethod
+    def open(path, mode, compress):
+        """
+        Opens a file for reading. Compressed files are read through a large buffer so that zlib
+        decompresses large blocks rather than many small reads.
+
+        Args:
+            path: path to input file
+            mode: file open mode
+            compress: True if file is gzip compressed
+
+        Returns:
+            file stream
+        """
+
+        if compress:
+            stream = io.BufferedReader(
+                gzip.open(path, "rb"), buffer_size=Execute.READ_BUFFER_SIZE
+            )
+            return io.TextIOWrapper(stream, encoding="utf-8") if mode == "r" else stream
+
+        return open(path, mode, encoding="utf-8" if mode == "r" else None)
+
     @staticmethod
     def parse(path, filename, extension, compress, config):
         """
@@ -62,15 +113,16 @@ class Execute:
 
         logging.info(f"Processing: {path}")
 
+        # PDFs are streamed directly from disk to GROBID
+        if extension == "pdf":
+            yield PDF.parse(path, filename, compress, config)
+            return
+
         # Determine if file needs to be open in binary or text mode
         mode = Execute.mode(filename, extension)
 
-        with gzip.open(path, mode) if compress else open(
-            path, mode, encoding="utf-8" if mode == "r" else None
-        ) as stream:
-            if extension == "pdf":
-                yield PDF.parse(stream, filename, config)
-            elif extension == "xml":
+        with Execute.open(path, mode, compress) as stream:
+            if extension == "xml":
                 if filename and filename.lower().startswith("arxiv"):
                     yield from ARX.parse(stream, filename)
                 elif filename and filename.lower().startswith("pubmed"):
@@ -81,98 +133,360 @@ class Execute:
                 yield from CSV.parse(stream, filename)
 
     @staticmethod
-    def process(inputs, outputs):
+    def initialize(config, outputs, concurrency, poolsize, cpus, counter, logs, level):
+        """
+        Worker process initializer.
+
+        Args:
+            config: configuration dictionary, if any
+            outputs: queue used to send article chunks to the main process
+            concurrency: semaphore shared across workers that limits outstanding GROBID requests
+            poolsize: number of pooled GROBID connections, matches the number of concurrent PDFs
+            cpus: list of cpu ids to pin workers to, empty if not supported
+            counter: shared counter used to assign each worker the next cpu
+            logs: queue used to send log records to the main process
+            level: logging level
+        """
+
+        # Send log records to the main process listener instead of writing directly
+        root = logging.getLogger()
+        root.handlers = [QueueHandler(logs)]
+        root.setLevel(level)
+
+        # Store config once per worker instead of sending it with each file
+        Execute.CONFIG = config
+        Execute.OUTPUTS = outputs
+
+        # Limit number of in-flight GROBID requests across all workers
+        PDF.CONCURRENCY = concurrency
+
+        # Keep a pooled connection for each concurrently parsed PDF
+        PDF.POOLSIZE = poolsize
+
+        # Pin worker to a single cpu to keep parsing caches warm
+        if cpus:
+            with counter.get_lock():
+                cpu = cpus[counter.value % len(cpus)]
+                counter.value += 1
+
+            os.sched_setaffinity(0, {cpu})
+
+    @staticmethod
+    def process(batch):
+        """
+        Worker process task. Parses a batch of files. Batches of PDFs are parsed concurrently,
+        which keeps multiple GROBID requests in flight per worker process.
+
+        Args:
+            batch: list of parse parameters - (path, filename, extension, compress)
+
+        Returns:
+            number of article chunks sent to the main process
+        """
+
+        # Other file types are sent as single file batches, parsing is CPU bound
+        if len(batch) == 1:
+            return Execute.send(batch[0])
+
+        with ThreadPoolExecutor(len(batch)) as executor:
+            return sum(executor.map(Execute.send, batch))
+
+    @staticmethod
+    def send(params):
         """
-        Main worker process loop. Processes file paths stored in inputs and writes articles
-        to outputs. Writes a final message upon completion.
+        Parses all articles in a single file and sends them to the main process in chunks as they
+        are parsed. This bounds worker memory for large multi-article files. Parsing errors are
+        logged and skipped, articles parsed before the error are kept. GROBID connection errors
+        are raised, as every remaining PDF would fail the same way.
 
         Args:
-            inputs: inputs queue
-            outputs: outputs queue
+            params: parse parameters - (path, filename, extension, compress)
+
+        Returns:
+            number of article chunks sent
         """
 
+        count, chunk = 0, []
+
+        # pylint: disable=W0703
         try:
-            # Process until inputs queue is exhausted
-            while not inputs.empty():
-                params = inputs.get()
-                for result in Execute.parse(*params):
-                    outputs.put(result)
-        finally:
-            # Write message that process is complete
-            outputs.put(Execute.COMPLETE)
+            for article in Execute.parse(*params, Execute.CONFIG):
+                if article:
+                    chunk.append(article)
+
+                if len(chunk) == Execute.BATCH:
+                    Execute.OUTPUTS.put(chunk)
+                    count, chunk = count + 1, []
+        except requests.ConnectionError as e:
+            # Raise without the request object, which can't be sent back to the main process
+            raise requests.ConnectionError(
+                f"Failed to connect to GROBID while processing {params[0]}: {e}"
+            ) from None
+        except Exception:
+            logging.exception(f"Failed to process file: {params[0]}")
+
+        if chunk:
+            Execute.OUTPUTS.put(chunk)
+            count += 1
+
+        return count
 
     @staticmethod
-    def scan(indir, config, inputs):
+    def scan(indir):
         """
-        Scans for files in indir and writes to inputs queue.
+        Scans for files in indir. Files are yielded as they are found, in directory order, so that
+        processing can start before the scan completes.
 
         Args:
             indir: input directory
-            config: path to config directory, if any
-            inputs: inputs queue
 
         Returns:
-            total number of items put into inputs queue
+            generator of parse parameters, one entry per file
         """
 
-        # Total number of files put into input queue
-        total = 0
-
         # Recursively walk directory looking for files
-        for root, _, files in sorted(os.walk(indir)):
-            for f in sorted(files):
-                # Extract file extension
-                parts = f.lower().split(".")
-                extension, compress = (
-                    (parts[-2], True) if parts[-1] == "gz" else (parts[-1], False)
-                )
+        directories = [indir]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+
+                    # Extract file extension
+                    base, extension = os.path.splitext(entry.name.lower())
+                    compress = extension == ".gz"
+                    if compress:
+                        extension = os.path.splitext(base)[1]
+
+                    # Check if file ends with accepted extension
+                    extension = extension[1:]
+                    if extension in Execute.EXTENSIONS and entry.is_file():
+                        yield (entry.path, entry.name, extension, compress)
+
+    @staticmethod
+    def batch(params, size):
+        """
+        Groups PDF parse parameters into batches. All other files are yielded as single file
+        batches, which keeps large XML and CSV files from being parsed together in one worker.
+
+        Args:
+            params: parse parameters generator
+            size: PDF batch size
+
+        Returns:
+            generator of parse parameter lists
+        """
+
+        batch = []
+        for param in params:
+            if param[2] == "pdf":
+                batch.append(param)
+                if len(batch) == size:
+                    yield batch
+                    batch = []
+            else:
+                yield [param]
+
+        if batch:
+            yield batch
+
+    @staticmethod
+    def throttle(batches, slots, stop):
+        """
+        Limits the number of batches queued for worker processes. Each batch waits for a free slot,
+        slots are released as batches complete.
+
+        Args:
+            batches: generator of parse parameter lists
+            slots: semaphore with a slot for each batch allowed in flight
+            stop: event set when processing ends, unblocks a waiting scan
 
-                # Check if file ends with accepted extension
-                if any(extension for ext in ["csv", "pdf", "xml"] if ext == extension):
-                    # Build full path to file
-                    path = os.path.join(root, f)
+        Returns:
+            generator of parse parameter lists
+        """
 
-                    # Write parameters to inputs queue
-                    inputs.put((path, f, extension, compress, config))
-                    total += 1
+        for batch in batches:
+            # Wait for a free slot, exit if processing has ended
+            while not slots.acquire(timeout=1):
+                if stop.is_set():
+                    return
 
-        return total
+            yield batch
 
     @staticmethod
-    def save(processes, outputs, db):
+    def results(pool, batches, outputs, slots):
         """
-        Main consumer loop that saves articles created by worker processes.
+        Runs batches on worker processes and yields article chunks as workers send them.
 
         Args:
-            processes: list of worker processes
-            outputs: outputs queue
+            pool: worker process pool
+            batches: generator of parse parameter lists
+            outputs: queue workers send article chunks to
+            slots: semaphore released once per completed batch
+
+        Returns:
+            generator of article lists
+        """
+
+        # Total number of chunks sent, set once all batches complete, and worker errors
+        state = {}
+
+        # Start thread that waits on batch completion
+        monitor = Thread(
+            target=Execute.monitor,
+            args=(pool.imap_unordered(Execute.process, batches), outputs, slots, state),
+            daemon=True,
+        )
+        monitor.start()
+
+        received = 0
+        while "total" not in state or received < state["total"]:
+            chunk = outputs.get()
+
+            # Completion message from monitor thread
+            if chunk is None:
+                if "error" in state:
+                    raise state["error"]
+            else:
+                received += 1
+                yield chunk
+
+    @staticmethod
+    def monitor(results, outputs, slots, state):
+        """
+        Batch completion thread loop. Releases a slot for each completed batch. Once all batches are
+        complete, stores the total number of chunks sent and wakes up the main thread.
+
+        Args:
+            results: iterable of chunk counts returned by worker processes
+            outputs: queue workers send article chunks to
+            slots: semaphore released once per completed batch
+            state: dict to store the total number of chunks sent or the first worker error
+        """
+
+        total = 0
+
+        # pylint: disable=W0703
+        try:
+            for count in results:
+                # Allow another batch to be queued for the worker processes
+                slots.release()
+                total += count
+
+            state["total"] = total
+        except Exception as e:
+            state["error"] = e
+
+        outputs.put(None)
+
+    @staticmethod
+    def save(results, db):
+        """
+        Main consumer loop that saves articles created by worker processes. Articles are handed
+        off to a database writer thread, which lets saving overlap with receiving results.
+
+        Args:
+            results: iterable of article lists sent by worker processes
             db: output database
         """
 
-        # Read output from worker processes
-        empty, complete = False, 0
-        while not empty:
-            # Get next result
-            result = outputs.get()
+        # Articles queue, limit size to bound memory when the database falls behind
+        queue, errors = Queue(Execute.BATCH * 10), []
+
+        # Start database writer thread
+        writer = Thread(target=Execute.write, args=(queue, db, errors))
+        writer.start()
 
-            # Mark process as complete if all workers are complete and output queue is empty
-            if result == Execute.COMPLETE:
-                complete += 1
-                empty = len(processes) == complete and outputs.empty()
+        try:
+            for articles in results:
+                # Stop processing as soon as the database writer fails
+                if errors:
+                    break
+
+                for article in articles:
+                    queue.put(article)
+        finally:
+            # Signal writer thread that all articles have been sent
+            queue.put(None)
+            writer.join()
 
-            # Save article, this method will skip duplicates based on entry date
-            elif result:
-                db.save(result)
+        # Raise database errors in main thread
+        if errors:
+            raise errors[0]
 
     @staticmethod
-    def least_used_cpus():
-        # Get per-core CPU utilization
-        cpu_usage = psutil.cpu_percent(percpu=True)
-        cpu_usage = list(zip(range(len(cpu_usage)), cpu_usage)) # Add core number
-        cpu_usage = sorted(cpu_usage, key=lambda x: x[1], reverse=True)
-        least_used_cpus = [x[0] for x in cpu_usage]
-        return least_used_cpus
-    
+    def write(queue, db, errors):
+        """
+        Database writer thread loop. Saves articles in batches until a None sentinel is received.
+
+        Args:
+            queue: articles queue
+            db: output database
+            errors: list to store database errors raised in this thread
+        """
+
+        complete = False
+        while not complete:
+            # Wait for next article then take what else is already available, up to batch size
+            batch = [queue.get()]
+            while batch[-1] is not None and len(batch) < Execute.BATCH:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+
+            complete = batch[-1] is None
+            batch = batch[:-1] if complete else batch
+
+            # Save articles, this method will skip duplicates based on entry date
+            if batch and not errors:
+                try:
+                    db.savemany(batch)
+                # pylint: disable=W0703
+                except Exception as e:
+                    # Keep draining queue so the main thread doesn't block
+                    errors.append(e)
+
+    @staticmethod
+    @contextmanager
+    def logger(config):
+        """
+        Routes log records from worker processes through a single listener thread in the main
+        process. Records are written to the configured logfile, if any, and the root logger handlers.
+
+        Args:
+            config: configuration dictionary, if any
+
+        Returns:
+            queue that worker processes send log records to
+        """
+
+        root = logging.getLogger()
+
+        # Add logfile handler, if configured
+        handler = None
+        if config and config.get("logfile"):
+            handler = logging.FileHandler(config["logfile"])
+            handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            root.addHandler(handler)
+
+        # Fall back to stderr for warnings and errors when logging isn't configured
+        handlers = root.handlers if root.handlers else [logging.lastResort]
+
+        logs = ProcessQueue()
+        listener = QueueListener(logs, *handlers, respect_handler_level=True)
+        listener.start()
+
+        try:
+            yield logs
+        finally:
+            listener.stop()
+
+            if handler:
+                root.removeHandler(handler)
+                handler.close()
+
     @staticmethod
     def run(indir, url, dbname, config=None, replace=False):
         """
@@ -186,7 +500,6 @@ class Execute:
         """
 
         if config:
-            logging.info(f"Using config: {config}")
             with open(config) as fd:
                 config = json.load(fd)
             indir = config["indir"]
@@ -194,32 +507,81 @@ class Execute:
             dbname = config["dbname"]
             replace = config["replace"]
 
-        # Build database connection
-        db = Factory.create(url, dbname, replace)
-
-        # Create queues, limit size of output queue
-        inputs, outputs = Queue(), Queue(30000)
-
-        # Scan input directory and add files to inputs queue
-        total = Execute.scan(indir, config, inputs)
-        
-        # Start worker processes
-        processes = []
-        num_workers = min(total, os.cpu_count())
-        worker_ids = Execute.least_used_cpus()[:num_workers]
-        logging.info(f"Starting {num_workers} processes on cpus: {worker_ids}")
-        for _ in worker_ids:
-            process = Process(target=Execute.process, args=(inputs, outputs))
-            process.start()
-            processes.append(process)
-
-        # Read results from worker processes and save to database
-        Execute.save(processes, outputs, db)
-
-        # Complete and close database
-        db.complete()
-        db.close()
-
-        # Wait for processes to terminate
-        for process in processes:
-            process.join()
+        # Number of concurrent GROBID requests
+        grobid = (
+            config.get("grobid_concurrency", Execute.CONCURRENCY)
+            if config
+            else Execute.CONCURRENCY
+        )
+        if isinstance(grobid, bool) or not isinstance(grobid, int) or grobid < 1:
+            raise ValueError(
+                f"grobid_concurrency must be a positive integer, got {grobid!r}"
+            )
+
+        with Execute.logger(config) as logs:
+            if config:
+                logging.info(f"Using config: {config}")
+
+            # Build database connection
+            db = Factory.create(url, dbname, replace)
+
+            # Limit outstanding GROBID requests to GROBID's configured concurrency
+            concurrency = BoundedSemaphore(grobid)
+
+            # Cpus this process is allowed to run on, respects taskset and container limits
+            allowed = (
+                sorted(os.sched_getaffinity(0))
+                if hasattr(os, "sched_getaffinity")
+                else list(range(os.cpu_count()))
+            )
+
+            # Start worker processes, when GROBID is configured workers beyond its concurrency
+            # would only wait on GROBID
+            num_workers = len(allowed)
+            if config and config.get("host_port") and "grobid_concurrency" in config:
+                num_workers = min(num_workers, grobid)
+
+            # Assign each worker a dedicated cpu, when supported by the platform
+            cpus = allowed[:num_workers] if hasattr(os, "sched_setaffinity") else []
+
+            # PDFs per worker task, large enough for all workers together to saturate GROBID
+            size = max(Execute.CHUNKSIZE, -(-grobid // num_workers))
+
+            logging.info(f"Starting {num_workers} processes on cpus: {cpus}")
+
+            # Article chunks sent by workers, limit size to bound memory
+            outputs = ProcessQueue(Execute.QUEUESIZE)
+
+            with Pool(
+                num_workers,
+                initializer=Execute.initialize,
+                initargs=(
+                    config,
+                    outputs,
+                    concurrency,
+                    size,
+                    cpus,
+                    Value("i", 0),
+                    logs,
+                    logging.getLogger().level,
+                ),
+            ) as pool:
+                # Limit number of batches queued for workers to bound memory usage
+                slots, stop = Semaphore(num_workers * 4), Event()
+
+                # Scan input directory while workers process files
+                batches = Execute.throttle(
+                    Execute.batch(Execute.scan(indir), size), slots, stop
+                )
+
+                try:
+                    # Read results from worker processes and save to database
+                    Execute.save(Execute.results(pool, batches, outputs, slots), db)
+
+                    # Complete database
+                    db.complete()
+                finally:
+                    stop.set()
+
+                    # Close database, keeps articles saved before a failure
+                    db.close()
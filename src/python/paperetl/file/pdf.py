@@ -2,15 +2,20 @@
 PDF processing module
 """
 
-from io import StringIO
+import gzip
+
+from contextlib import nullcontext
+from threading import Lock
 
 import requests
 
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+
 from .tei import TEI
 
-import time
-import shutil
 import os
+import tempfile
 import logging
 logging.getLogger(__name__)
 
@@ -19,55 +24,167 @@ class PDF:
     Methods to transform medical/scientific PDFs into article objects.
     """
 
+    # Semaphore limiting the number of outstanding GROBID requests, set per worker process
+    CONCURRENCY = None
+
+    # HTTP session used to keep GROBID connections alive, created per process on first use
+    SESSION = None
+
+    # Guards session creation across parsing threads
+    LOCK = Lock()
+
+    # Maximum number of pooled connections per host, set per worker process to the PDF batch size
+    POOLSIZE = 16
+
     @staticmethod
-    def parse(stream, filename, config):
+    def parse(path, filename, compress, config):
         """
-        Parses a medical/scientific PDF datastream and returns a processed article.
+        Parses a medical/scientific PDF file and returns a processed article.
 
         Args:
-            stream: handle to input data stream
-            source: text string describing stream source, can be None
+            path: path to input PDF file
+            filename: text string describing file source
+            compress: True if input file is gzip compressed
+            config: configuration dictionary
 
         Returns:
             Article
         """
 
-        # Attempt to convert PDF to TEI XML
-        xml = PDF.convert(stream, config)
-        logging.debug(xml.getvalue())
-        if config and config["xml_dir"]:
-            # Save XML file
+        if config and config.get("xml_dir"):
             filename = ".".join(filename.split(".")[:-1])
-            with open(os.path.join(config["xml_dir"], f'{filename}.xml'), 'w') as fd:
-                xml.seek(0)
-                shutil.copyfileobj(xml, fd)
-                xml.seek(0)
+            output = PDF.output(path, config)
+
+            # Reuse TEI XML from a previous run, if available. Falls back to the flat
+            # {xml_dir}/{name}.xml layout written by earlier versions.
+            for cached in (output, os.path.join(config["xml_dir"], f"{filename}.xml")):
+                if os.path.exists(cached) and os.path.getsize(cached) > 0:
+                    with open(cached, "rb") as fd:
+                        return TEI.parse(fd.read(), filename)
+
+            # Attempt to convert PDF to TEI XML and save raw XML bytes
+            xml = PDF.convert(path, compress, config)
+            if xml:
+                PDF.save(xml, output)
+        else:
+            # Attempt to convert PDF to TEI XML
+            xml = PDF.convert(path, compress, config)
+
         # Parse and return object
         return TEI.parse(xml, filename) if xml else None
 
     @staticmethod
-    def convert(stream, config):
+    def output(path, config):
+        """
+        Builds the TEI XML output path for a PDF. The path mirrors the PDF's location relative to
+        the input directory, so that PDFs with the same name in different directories don't share
+        cached XML.
+
+        Args:
+            path: path to input PDF file
+            config: configuration dictionary
+
+        Returns:
+            path to TEI XML file
+        """
+
+        name = (
+            os.path.relpath(path, config["indir"])
+            if config.get("indir")
+            else os.path.basename(path)
+        )
+        name = ".".join(name.split(".")[:-1])
+
+        return os.path.join(config["xml_dir"], f"{name}.xml")
+
+    @staticmethod
+    def save(xml, output):
+        """
+        Saves TEI XML to output. XML is written to a temporary file first and moved into place,
+        so an interrupted write never leaves a partial file that a later run would reuse.
+
+        Args:
+            xml: TEI XML bytes
+            output: path to TEI XML file
+        """
+
+        directory = os.path.dirname(output)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(xml)
+
+            os.replace(temp, output)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    @staticmethod
+    def convert(path, compress, config):
         """
         Converts a medical/scientific article PDF into TEI XML via a GROBID Web Service API call.
 
         Args:
-            stream: handle to input data stream
+            path: path to input PDF file
+            compress: True if input file is gzip compressed
+            config: configuration dictionary
 
         Returns:
-            TEI XML stream
+            TEI XML bytes
         """
         logging.debug("Making GROBID API call")
-        # Call GROBID API
-        response = requests.post(
-            # replacing with the server
-            f"http://{config["host_port"]}/api/processFulltextDocument", files={"input": stream, "consolidateFunders": "1", "consolidateHeader": "1", "consolidateCitations": "1", "includeRawAffiliations": "1"}
-        )
-        time.sleep(7) # wait until next grobid api call
+        with gzip.open(path, "rb") if compress else open(path, "rb") as stream:
+            # Stream uncompressed files from disk, compressed files have no known length and are read in full
+            body = MultipartEncoder(
+                fields={
+                    "input": (
+                        os.path.basename(path),
+                        stream.read() if compress else stream,
+                        "application/pdf",
+                    ),
+                    "consolidateFunders": "1",
+                    "consolidateHeader": "1",
+                    "consolidateCitations": "1",
+                    "includeRawAffiliations": "1",
+                }
+            )
+
+            # Call GROBID API, blocks while the GROBID engine pool is saturated
+            with PDF.CONCURRENCY if PDF.CONCURRENCY else nullcontext():
+                response = PDF.session().post(
+                    f"http://{config['host_port']}/api/processFulltextDocument",
+                    data=body,
+                    headers={"Content-Type": body.content_type},
+                )
 
         # Validate request was successful
         if not response.ok:
             logging.info(f"Failed to process file - {response.text}")
             return None
 
-        # Wrap as StringIO
-        return StringIO(response.text)
+        # Return raw response bytes, avoids decoding the response to text
+        return response.content
+
+    @staticmethod
+    def session():
+        """
+        Gets the HTTP session for this process, creating it if necessary.
+
+        Returns:
+            requests.Session
+        """
+
+        with PDF.LOCK:
+            if not PDF.SESSION:
+                adapter = HTTPAdapter(
+                    pool_connections=PDF.POOLSIZE, pool_maxsize=PDF.POOLSIZE
+                )
+
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                PDF.SESSION = session
+
+        return PDF.SESSION
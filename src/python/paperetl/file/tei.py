@@ -27,7 +27,7 @@ class TEI:
         Parses a TEI XML datastream and returns a processed article.
 
         Args:
-            stream: handle to input data stream
+            stream: handle to input data stream or raw XML bytes
             source: text string describing stream source, can be None
 
         Returns:
@@ -96,8 +96,8 @@ class SQLite(Database):
         # Index fields
         self.aindex, self.sindex = 0, 0
 
-        # Connect to output database
-        self.db = sqlite3.connect(dbfile)
+        # Connect to output database, allow connection to be used by a database writer thread
+        self.db = sqlite3.connect(dbfile, check_same_thread=False)
 
         # Create database cursor
         self.cur = self.db.cursor()
@@ -125,7 +125,7 @@ class SQLite(Database):
             # Increment number of articles processed
             self.aindex += 1
             if self.aindex % 1000 == 0:
-                logging.info(f"Inserted {self.aindex} articles", end="\r")
+                logging.info(f"Inserted {self.aindex} articles")
 
                 # Commit current transaction and start a new one
                 self.transaction()
@@ -0,0 +1,282 @@
+"""
+File processing tests
+"""
+
+import gzip
+import os
+import tempfile
+import time
+import unittest
+
+from queue import Queue
+from threading import Event
+from unittest import mock
+
+import requests
+
+from paperetl.file.execute import Execute
+from paperetl.file.pdf import PDF
+
+
+class TestFile(unittest.TestCase):
+    """
+    File processing tests
+    """
+
+    def setUp(self):
+        """
+        Initialization run before each test. Creates a temporary directory.
+        """
+
+        # pylint: disable=R1732
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        """
+        Cleanup run after each test. Removes temporary directory.
+        """
+
+        self.directory.cleanup()
+
+    def write(self, name, content=b""):
+        """
+        Writes a file to the temporary directory.
+
+        Args:
+            name: file path relative to temporary directory
+            content: file content
+
+        Returns:
+            full path to file
+        """
+
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "wb") as output:
+            output.write(content)
+
+        return path
+
+    def testBatch(self):
+        """
+        Tests only PDFs are grouped into multi-file batches
+        """
+
+        params = [
+            (name, name, name.split(".")[-1], False)
+            for name in ["a.pdf", "x.xml", "b.pdf", "c.pdf", "y.csv", "d.pdf", "e.pdf"]
+        ]
+
+        batches = [[param[0] for param in batch] for batch in Execute.batch(params, 2)]
+
+        self.assertEqual(
+            batches,
+            [["x.xml"], ["a.pdf", "b.pdf"], ["y.csv"], ["c.pdf", "d.pdf"], ["e.pdf"]],
+        )
+
+    def testCompressedCSV(self):
+        """
+        Tests compressed CSV files are read in text mode
+        """
+
+        path = self.write(
+            "articles.csv.gz",
+            gzip.compress(b"id,title,abstract\n1,Title,Abstract text\n"),
+        )
+
+        articles = list(Execute.parse(path, "articles.csv.gz", "csv", True, None))
+
+        self.assertEqual(len(articles), 1)
+        self.assertEqual(articles[0].uid(), "1")
+        self.assertEqual(articles[0].sections, [(None, "Title Abstract text")])
+
+    def testSave(self):
+        """
+        Tests the database writer thread saves all articles in batches
+        """
+
+        db = mock.MagicMock()
+        results = ([chunk * 10 + x for x in range(10)] for chunk in range(100))
+
+        Execute.save(results, db)
+
+        batches = [args[0] for args, _ in db.savemany.call_args_list]
+        self.assertTrue(all(0 < len(batch) <= Execute.BATCH for batch in batches))
+        self.assertEqual(
+            sorted(x for batch in batches for x in batch), list(range(1000))
+        )
+        self.assertNotIn(None, [x for batch in batches for x in batch])
+
+    def testSaveError(self):
+        """
+        Tests database writer errors stop the consumer loop and are raised in the main thread
+        """
+
+        failed, consumed = Event(), []
+
+        def savemany(_):
+            failed.set()
+            raise ValueError("Database error")
+
+        def results():
+            for chunk in range(100):
+                consumed.append(chunk)
+                yield [chunk]
+
+                # Wait for the writer to fail, then keep sending slowly
+                if chunk:
+                    time.sleep(0.01)
+                else:
+                    failed.wait(5)
+
+        db = mock.MagicMock()
+        db.savemany.side_effect = savemany
+
+        with self.assertRaises(ValueError):
+            Execute.save(results(), db)
+
+        self.assertEqual(db.savemany.call_count, 1)
+        self.assertLess(len(consumed), 100)
+
+    def testScan(self):
+        """
+        Tests scanning an input directory for supported files
+        """
+
+        for name in [
+            "a.csv",
+            "notes.txt",
+            ".DS_Store",
+            ".csv",
+            "image.png",
+            "archive.gz",
+            "sub/pubmed.xml.gz",
+            "sub/PAPER.PDF",
+            "sub/deeper/tei.Xml",
+        ]:
+            self.write(name)
+
+        files = {
+            os.path.relpath(path, self.path): (filename, extension, compress)
+            for path, filename, extension, compress in Execute.scan(self.path)
+        }
+
+        self.assertEqual(
+            files,
+            {
+                "a.csv": ("a.csv", "csv", False),
+                os.path.join("sub", "pubmed.xml.gz"): ("pubmed.xml.gz", "xml", True),
+                os.path.join("sub", "PAPER.PDF"): ("PAPER.PDF", "pdf", False),
+                os.path.join("sub", "deeper", "tei.Xml"): ("tei.Xml", "xml", False),
+            },
+        )
+
+    @mock.patch(
+        "paperetl.file.pdf.TEI.parse", mock.MagicMock(side_effect=lambda xml, _: xml)
+    )
+    def testPDFCache(self):
+        """
+        Tests existing TEI XML is reused instead of calling GROBID
+        """
+
+        config = {
+            "indir": os.path.join(self.path, "pdfs"),
+            "xml_dir": os.path.join(self.path, "xml"),
+            "host_port": "localhost:8070",
+        }
+
+        path = self.write("pdfs/sub/paper.pdf")
+        self.write("xml/sub/paper.xml", b"<TEI>cached</TEI>")
+
+        with mock.patch("paperetl.file.pdf.requests.Session.post") as post:
+            self.assertEqual(
+                PDF.parse(path, "paper.pdf", False, config), b"<TEI>cached</TEI>"
+            )
+            post.assert_not_called()
+
+    @mock.patch(
+        "paperetl.file.pdf.TEI.parse", mock.MagicMock(side_effect=lambda xml, _: xml)
+    )
+    def testPDFCacheLegacy(self):
+        """
+        Tests TEI XML saved in the flat xml_dir layout of earlier versions is reused
+        """
+
+        config = {
+            "indir": os.path.join(self.path, "pdfs"),
+            "xml_dir": os.path.join(self.path, "xml"),
+            "host_port": "localhost:8070",
+        }
+
+        path = self.write("pdfs/sub/paper.pdf")
+        self.write("xml/paper.xml", b"<TEI>legacy</TEI>")
+
+        with mock.patch("paperetl.file.pdf.requests.Session.post") as post:
+            self.assertEqual(
+                PDF.parse(path, "paper.pdf", False, config), b"<TEI>legacy</TEI>"
+            )
+            post.assert_not_called()
+
+    @mock.patch(
+        "paperetl.file.pdf.TEI.parse", mock.MagicMock(side_effect=lambda xml, _: xml)
+    )
+    def testPDFCacheSave(self):
+        """
+        Tests converted TEI XML is saved relative to the input directory
+        """
+
+        config = {
+            "indir": os.path.join(self.path, "pdfs"),
+            "xml_dir": os.path.join(self.path, "xml"),
+            "host_port": "localhost:8070",
+        }
+
+        first = self.write("pdfs/a/paper.pdf")
+        second = self.write("pdfs/b/paper.pdf")
+
+        response = mock.MagicMock(ok=True, content=b"<TEI>converted</TEI>")
+        with mock.patch(
+            "paperetl.file.pdf.requests.Session.post", return_value=response
+        ) as post:
+            PDF.parse(first, "paper.pdf", False, config)
+            PDF.parse(second, "paper.pdf", False, config)
+
+            # Files with the same name in different directories don't share XML
+            self.assertEqual(post.call_count, 2)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, "xml"))), ["a", "b"])
+        self.assertEqual(os.listdir(os.path.join(self.path, "xml", "a")), ["paper.xml"])
+
+    def testSend(self):
+        """
+        Tests articles are sent in chunks and articles parsed before an error are kept
+        """
+
+        def parse(*_):
+            yield from range(1, 251)
+            raise ValueError("Bad record")
+
+        outputs = Queue()
+        with mock.patch.object(Execute, "OUTPUTS", outputs), mock.patch.object(
+            Execute, "parse", side_effect=parse
+        ):
+            self.assertEqual(
+                Execute.send(("pubmed.xml", "pubmed.xml", "xml", False)), 3
+            )
+
+        chunks = [outputs.get() for _ in range(outputs.qsize())]
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(chunks[-1][-1], 250)
+
+    def testSendConnectionError(self):
+        """
+        Tests GROBID connection errors stop processing
+        """
+
+        with mock.patch.object(Execute, "OUTPUTS", Queue()), mock.patch.object(
+            Execute, "parse", side_effect=requests.ConnectionError("Connection refused")
+        ):
+            with self.assertRaises(requests.ConnectionError):
+                Execute.send(("paper.pdf", "paper.pdf", "pdf", False))
@@ -21,8 +21,8 @@ class RequestsStub:
 
     def __init__(self):
         self.ok = True
-        with open(Utils.FILE + "/data/0.xml", "r", encoding="utf-8") as xml:
-            self.text = xml.read()
+        with open(Utils.FILE + "/data/0.xml", "rb") as xml:
+            self.content = xml.read()
 
 
 class TestFileDatabase(TestProcess):
@@ -100,14 +100,20 @@ class TestFileDatabase(TestProcess):
         self.articles(hashes)
 
     @mock.patch(
-        "paperetl.file.pdf.requests.post", mock.MagicMock(return_value=RequestsStub())
+        "paperetl.file.pdf.requests.Session.post",
+        mock.MagicMock(return_value=RequestsStub()),
     )
     def testPDF(self):
         """
         Tests parsing PDFs
         """
 
-        article = PDF.parse("stream", "source")
+        article = PDF.parse(
+            Utils.FILE + "/data/0.xml",
+            "source",
+            False,
+            {"host_port": "localhost:8070", "xml_dir": None},
+        )
 
         # Calculate metadata hash
         md5 = Utils.hashtext(" ".join([str(x) for x in article.metadata[:-1]]))